@@ -137,8 +137,7 @@ type Session = {
   models: SessionModelState;
   configOptions: SessionConfigOption[];
   promptRunning: boolean;
-  pendingMessages: Map<string, { resolve: (cancelled: boolean) => void; order: number }>;
-  nextPendingOrder: number;
+  pendingMessages: Map<string, { resolve: (cancelled: boolean) => void }>;
   abortController: AbortController;
   emitRawSDKMessages: boolean | SDKMessageFilter[];
   /** Context window size of the last top-level assistant model, carried across
@@ -282,6 +281,10 @@ const ALLOW_BYPASS = !IS_ROOT || !!process.env.IS_SANDBOX;
 // message and without invoking the model.
 const LOCAL_ONLY_COMMANDS = new Set(["/context", "/heapdump", "/extra-usage"]);
 
+// Assistant content block types that are already forwarded from stream events
+// and must be skipped when the complete assistant message arrives.
+const STREAMED_CONTENT_TYPES = new Set(["text", "thinking"]);
+
 const PERMISSION_MODE_ALIASES: Record<string, PermissionMode> = {
   auto: "auto",
   default: "default",
@@ -292,6 +295,18 @@ const PERMISSION_MODE_ALIASES: Record<string, PermissionMode> = {
   bypass: "bypassPermissions",
 };
 
+// Modes the user can switch to when approving an ExitPlanMode request.
+const EXIT_PLAN_MODE_TARGETS: ReadonlySet<string> = new Set<PermissionMode>([
+  "default",
+  "acceptEdits",
+  "auto",
+  "bypassPermissions",
+]);
+
+function isExitPlanModeTarget(optionId: string): optionId is PermissionMode {
+  return EXIT_PLAN_MODE_TARGETS.has(optionId);
+}
+
 export function resolvePermissionMode(defaultMode?: unknown): PermissionMode {
   if (defaultMode === undefined) {
     return "default";
@@ -477,9 +492,7 @@ export class ClaudeAcpAgent implements Agent {
       resume: (params._meta as NewSessionMeta | undefined)?.claudeCode?.options?.resume,
     });
     // Needs to happen after we return the session
-    setTimeout(() => {
-      this.sendAvailableCommandsUpdate(response.sessionId);
-    }, 0);
+    this.scheduleAvailableCommandsUpdate(response.sessionId);
     return response;
   }
 
@@ -496,9 +509,7 @@ export class ClaudeAcpAgent implements Agent {
       },
     );
     // Needs to happen after we return the session
-    setTimeout(() => {
-      this.sendAvailableCommandsUpdate(response.sessionId);
-    }, 0);
+    this.scheduleAvailableCommandsUpdate(response.sessionId);
     return response;
   }
 
@@ -506,9 +517,7 @@ export class ClaudeAcpAgent implements Agent {
     const result = await this.getOrCreateSession(params);
 
     // Needs to happen after we return the session
-    setTimeout(() => {
-      this.sendAvailableCommandsUpdate(params.sessionId);
-    }, 0);
+    this.scheduleAvailableCommandsUpdate(params.sessionId);
     return result;
   }
 
@@ -518,9 +527,7 @@ export class ClaudeAcpAgent implements Agent {
     await this.replaySessionHistory(params.sessionId);
 
     // Send available commands after replay so it doesn't interleave with history
-    setTimeout(() => {
-      this.sendAvailableCommandsUpdate(params.sessionId);
-    }, 0);
+    this.scheduleAvailableCommandsUpdate(params.sessionId);
 
     return result;
   }
@@ -583,9 +590,8 @@ export class ClaudeAcpAgent implements Agent {
 
     if (session.promptRunning) {
       session.input.push(userMessage);
-      const order = session.nextPendingOrder++;
       const cancelled = await new Promise<boolean>((resolve) => {
-        session.pendingMessages.set(promptUuid, { resolve, order });
+        session.pendingMessages.set(promptUuid, { resolve });
       });
       if (cancelled) {
         return { stopReason: "cancelled" };
@@ -875,15 +881,17 @@ export class ClaudeAcpAgent implements Agent {
             }
 
             // Check for prompt replay
-            if (message.type === "user" && "uuid" in message && message.uuid) {
-              if (message.uuid === promptUuid) {
+            const replayUuid =
+              message.type === "user" && "uuid" in message ? (message.uuid as string) : undefined;
+            if (replayUuid) {
+              if (replayUuid === promptUuid) {
                 break;
               }
 
-              const pending = session.pendingMessages.get(message.uuid as string);
+              const pending = session.pendingMessages.get(replayUuid);
               if (pending) {
                 pending.resolve(false);
-                session.pendingMessages.delete(message.uuid as string);
+                session.pendingMessages.delete(replayUuid);
                 handedOff = true;
                 // the current loop stops with end_turn,
                 // the loop of the next prompt continues running
@@ -907,30 +915,28 @@ export class ClaudeAcpAgent implements Agent {
               }
             }
 
+            const messageContent = message.message.content;
+            const isStringContent = typeof messageContent === "string";
+
             // Slash commands like /compact can generate invalid output... doesn't match
             // their own docs: https://docs.anthropic.com/en/docs/claude-code/sdk/sdk-slash-commands#%2Fcompact-compact-conversation-history
-            if (
-              typeof message.message.content === "string" &&
-              message.message.content.includes("<local-command-stdout>")
-            ) {
-              this.logger.log(message.message.content);
-              break;
-            }
-
-            if (
-              typeof message.message.content === "string" &&
-              message.message.content.includes("<local-command-stderr>")
-            ) {
-              this.logger.error(message.message.content);
-              break;
+            if (isStringContent) {
+              if (messageContent.includes("<local-command-stdout>")) {
+                this.logger.log(messageContent);
+                break;
+              }
+              if (messageContent.includes("<local-command-stderr>")) {
+                this.logger.error(messageContent);
+                break;
+              }
             }
             // Skip these user messages for now, since they seem to just be messages we don't want in the feed
             if (
               message.type === "user" &&
-              (typeof message.message.content === "string" ||
-                (Array.isArray(message.message.content) &&
-                  message.message.content.length === 1 &&
-                  message.message.content[0].type === "text"))
+              (isStringContent ||
+                (Array.isArray(messageContent) &&
+                  messageContent.length === 1 &&
+                  messageContent[0].type === "text"))
             ) {
               break;
             }
@@ -938,10 +944,10 @@ export class ClaudeAcpAgent implements Agent {
             if (
               message.type === "assistant" &&
               message.message.model === "<synthetic>" &&
-              Array.isArray(message.message.content) &&
-              message.message.content.length === 1 &&
-              message.message.content[0].type === "text" &&
-              message.message.content[0].text.includes("Please run /login")
+              Array.isArray(messageContent) &&
+              messageContent.length === 1 &&
+              messageContent[0].type === "text" &&
+              messageContent[0].text.includes("Please run /login")
             ) {
               throw RequestError.authRequired();
             }
@@ -949,10 +955,8 @@ export class ClaudeAcpAgent implements Agent {
             const content =
               message.type === "assistant"
                 ? // Handled by stream events above
-                  message.message.content.filter(
-                    (item) => !["text", "thinking"].includes(item.type),
-                  )
-                : message.message.content;
+                  message.message.content.filter((item) => !STREAMED_CONTENT_TYPES.has(item.type))
+                : messageContent;
 
             for (const notification of toAcpNotifications(
               content,
@@ -1011,14 +1015,13 @@ export class ClaudeAcpAgent implements Agent {
         // This usually should not happen, but in case the loop finishes
         // without claude sending all message replays, we resolve the
         // next pending prompt call to ensure no prompts get stuck.
-        if (session.pendingMessages.size > 0) {
-          const next = [...session.pendingMessages.entries()].sort(
-            (a, b) => a[1].order - b[1].order,
-          )[0];
-          if (next) {
-            next[1].resolve(false);
-            session.pendingMessages.delete(next[0]);
-          }
+        // Maps iterate in insertion order, so the first entry is the oldest
+        // pending prompt.
+        const first = session.pendingMessages.entries().next().value;
+        if (first) {
+          const [uuid, next] = first;
+          next.resolve(false);
+          session.pendingMessages.delete(uuid);
         }
       }
     }
@@ -1259,31 +1262,25 @@ export class ClaudeAcpAgent implements Agent {
           },
         });
 
-        if (signal.aborted || response.outcome?.outcome === "cancelled") {
+        const outcome = response.outcome;
+        if (signal.aborted || outcome?.outcome === "cancelled") {
           throw new Error("Tool use aborted");
         }
-        if (
-          response.outcome?.outcome === "selected" &&
-          (response.outcome.optionId === "default" ||
-            response.outcome.optionId === "acceptEdits" ||
-            response.outcome.optionId === "auto" ||
-            response.outcome.optionId === "bypassPermissions")
-        ) {
+        if (outcome?.outcome === "selected" && isExitPlanModeTarget(outcome.optionId)) {
+          const mode = outcome.optionId;
           await this.client.sessionUpdate({
             sessionId,
             update: {
               sessionUpdate: "current_mode_update",
-              currentModeId: response.outcome.optionId,
+              currentModeId: mode,
             },
           });
-          await this.updateConfigOption(sessionId, "mode", response.outcome.optionId);
+          await this.updateConfigOption(sessionId, "mode", mode);
 
           return {
             behavior: "allow",
             updatedInput: toolInput,
-            updatedPermissions: suggestions ?? [
-              { type: "setMode", mode: response.outcome.optionId, destination: "session" },
-            ],
+            updatedPermissions: suggestions ?? [{ type: "setMode", mode, destination: "session" }],
           };
         } else {
           return {
@@ -1359,6 +1356,13 @@ export class ClaudeAcpAgent implements Agent {
     };
   }
 
+  /** Send available_commands_update after the current response is queued. */
+  private scheduleAvailableCommandsUpdate(sessionId: string): void {
+    setImmediate(() => {
+      this.sendAvailableCommandsUpdate(sessionId);
+    });
+  }
+
   private async sendAvailableCommandsUpdate(sessionId: string): Promise<void> {
     const session = this.sessions[sessionId];
     if (!session) return;
@@ -1711,7 +1715,6 @@ export class ClaudeAcpAgent implements Agent {
       configOptions,
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       abortController,
       emitRawSDKMessages: sessionMeta?.claudeCode?.emitRawSDKMessages ?? false,
       contextWindowSize:
@@ -1837,13 +1840,15 @@ function buildConfigOptions(
 // Claude Code CLI persists display strings like "opus[1m]" in settings,
 // but the SDK model list uses IDs like "claude-opus-4-6-1m".
 const MODEL_CONTEXT_HINT_PATTERN = /\[(\d+m)\]$/i;
+const MODEL_TOKEN_SEPARATOR_PATTERN = /[^a-z0-9]+/;
+const HAS_LETTER_PATTERN = /[a-z]/;
 
 function tokenizeModelPreference(model: string): { tokens: string[]; contextHint?: string } {
   const lower = model.trim().toLowerCase();
   const contextHint = lower.match(MODEL_CONTEXT_HINT_PATTERN)?.[1]?.toLowerCase();
 
   const normalized = lower.replace(MODEL_CONTEXT_HINT_PATTERN, " $1 ");
-  const rawTokens = normalized.split(/[^a-z0-9]+/).filter(Boolean);
+  const rawTokens = normalized.split(MODEL_TOKEN_SEPARATOR_PATTERN).filter(Boolean);
   const tokens = rawTokens
     .map((token) => {
       if (token === "opusplan") return "opus";
@@ -1851,7 +1856,7 @@ function tokenizeModelPreference(model: string): { tokens: string[]; contextHint
       return token;
     })
     .filter((token) => token && token !== "claude")
-    .filter((token) => /[a-z]/.test(token) || token.endsWith("m"));
+    .filter((token) => HAS_LETTER_PATTERN.test(token) || token.endsWith("m"));
 
   return { tokens, contextHint };
 }
@@ -1944,37 +1949,40 @@ async function getAvailableModels(
   };
 }
 
-function getAvailableSlashCommands(commands: SlashCommand[]): AvailableCommand[] {
-  const UNSUPPORTED_COMMANDS = [
-    "cost",
-    "keybindings-help",
-    "login",
-    "logout",
-    "output-style:new",
-    "release-notes",
-    "todos",
-  ];
+const UNSUPPORTED_COMMANDS = new Set([
+  "cost",
+  "keybindings-help",
+  "login",
+  "logout",
+  "output-style:new",
+  "release-notes",
+  "todos",
+]);
 
-  return commands
-    .map((command) => {
-      const input = command.argumentHint
-        ? {
-            hint: Array.isArray(command.argumentHint)
-              ? command.argumentHint.join(" ")
-              : command.argumentHint,
-          }
-        : null;
-      let name = command.name;
-      if (command.name.endsWith(" (MCP)")) {
-        name = `mcp:${name.replace(" (MCP)", "")}`;
-      }
-      return {
-        name,
-        description: command.description || "",
-        input,
-      };
-    })
-    .filter((command: AvailableCommand) => !UNSUPPORTED_COMMANDS.includes(command.name));
+function getAvailableSlashCommands(commands: SlashCommand[]): AvailableCommand[] {
+  const available: AvailableCommand[] = [];
+  for (const command of commands) {
+    let name = command.name;
+    if (name.endsWith(" (MCP)")) {
+      name = `mcp:${name.replace(" (MCP)", "")}`;
+    }
+    if (UNSUPPORTED_COMMANDS.has(name)) {
+      continue;
+    }
+    const input = command.argumentHint
+      ? {
+          hint: Array.isArray(command.argumentHint)
+            ? command.argumentHint.join(" ")
+            : command.argumentHint,
+        }
+      : null;
+    available.push({
+      name,
+      description: command.description || "",
+      input,
+    });
+  }
+  return available;
 }
 
 function formatUriAsLink(uri: string): string {
@@ -1994,6 +2002,10 @@ function formatUriAsLink(uri: string): string {
   }
 }
 
+// Matches "/mcp:server:command args" so it can be rewritten to the SDK's
+// "/server:command (MCP) args" form.
+const MCP_SLASH_COMMAND_PATTERN = /^\/mcp:([^:\s]+):(\S+)(?:\s(.*))?$/;
+
 export function promptToClaude(prompt: PromptRequest): SDKUserMessage {
   const content: any[] = [];
   const context: any[] = [];
@@ -2003,7 +2015,7 @@ export function promptToClaude(prompt: PromptRequest): SDKUserMessage {
       case "text": {
         let text = chunk.text;
         // change /mcp:server:command args -> /server:command (MCP) args
-        const mcpMatch = text.match(/^\/mcp:([^:\s]+):(\S+)(?:\s(.*))?$/);
+        const mcpMatch = text.startsWith("/mcp:") ? text.match(MCP_SLASH_COMMAND_PATTERN) : null;
         if (mcpMatch) {
           const [, server, command, args] = mcpMatch;
           text = `/${server}:${command} (MCP)${args ? ` ${args}` : ""}`;
@@ -2093,6 +2105,8 @@ export function toAcpNotifications(
 ): SessionNotification[] {
   const registerHooks = options?.registerHooks !== false;
   const supportsTerminalOutput = options?.clientCapabilities?._meta?.["terminal_output"] === true;
+  const parentToolUseId = options?.parentToolUseId;
+  const cwd = options?.cwd;
   if (typeof content === "string") {
     const update: SessionNotification["update"] = {
       sessionUpdate: role === "assistant" ? "agent_message_chunk" : "user_message_chunk",
@@ -2102,14 +2116,8 @@ export function toAcpNotifications(
       },
     };
 
-    if (options?.parentToolUseId) {
-      update._meta = {
-        ...update._meta,
-        claudeCode: {
-          ...(update._meta?.claudeCode || {}),
-          parentToolUseId: options.parentToolUseId,
-        },
-      };
+    if (parentToolUseId) {
+      tagParentToolUseId(update, parentToolUseId);
     }
 
     return [{ sessionId, update }];
@@ -2217,7 +2225,7 @@ export function toAcpNotifications(
               toolCallId: chunk.id,
               sessionUpdate: "tool_call_update",
               rawInput,
-              ...toolInfoFromToolUse(chunk, supportsTerminalOutput, options?.cwd),
+              ...toolInfoFromToolUse(chunk, supportsTerminalOutput, cwd),
             };
           } else {
             // First encounter (streaming content_block_start or replay) —
@@ -2235,7 +2243,7 @@ export function toAcpNotifications(
               sessionUpdate: "tool_call",
               rawInput,
               status: "pending",
-              ...toolInfoFromToolUse(chunk, supportsTerminalOutput, options?.cwd),
+              ...toolInfoFromToolUse(chunk, supportsTerminalOutput, cwd),
             };
           }
         }
@@ -2276,9 +2284,7 @@ export function toAcpNotifications(
               update: {
                 _meta: {
                   terminal_output: toolMeta.terminal_output,
-                  ...(options?.parentToolUseId
-                    ? { claudeCode: { parentToolUseId: options.parentToolUseId } }
-                    : {}),
+                  ...(parentToolUseId ? { claudeCode: { parentToolUseId } } : {}),
                 },
                 toolCallId: chunk.tool_use_id,
                 sessionUpdate: "tool_call_update" as const,
@@ -2320,14 +2326,8 @@ export function toAcpNotifications(
         break;
     }
     if (update) {
-      if (options?.parentToolUseId) {
-        update._meta = {
-          ...update._meta,
-          claudeCode: {
-            ...(update._meta?.claudeCode || {}),
-            parentToolUseId: options.parentToolUseId,
-          },
-        };
+      if (parentToolUseId) {
+        tagParentToolUseId(update, parentToolUseId);
       }
       output.push({ sessionId, update });
     }
@@ -2336,6 +2336,24 @@ export function toAcpNotifications(
   return output;
 }
 
+/** Record the subagent a notification belongs to in `_meta.claudeCode`.
+ *  Most updates carry no `_meta` yet, so build that object directly instead
+ *  of spreading empty defaults into it. */
+function tagParentToolUseId(update: SessionNotification["update"], parentToolUseId: string): void {
+  const meta = update._meta;
+  if (!meta) {
+    update._meta = { claudeCode: { parentToolUseId } };
+    return;
+  }
+  update._meta = {
+    ...meta,
+    claudeCode: {
+      ...(meta.claudeCode as Record<string, unknown> | undefined),
+      parentToolUseId,
+    },
+  };
+}
+
 export function streamEventToAcpNotifications(
   message: SDKPartialAssistantMessage,
   sessionId: string,
@@ -2411,13 +2429,15 @@ function commonPrefixLength(a: string, b: string) {
   return i;
 }
 
+const ONE_MILLION_CONTEXT_PATTERN = /\b1m\b/i;
+
 /** Best-effort first guess of a model's context window from its ID, used only
  *  until a `result` message arrives with the authoritative `modelUsage` value.
  *  Anthropic 1M-context variants encode "1m" as a distinct token in the SDK
  *  model ID (e.g., "claude-opus-4-6-1m"), which `\b1m\b` catches without also
  *  matching things like "10m" or embedded substrings. */
 function inferContextWindowFromModel(model: string): number | null {
-  if (/\b1m\b/i.test(model)) return 1_000_000;
+  if (ONE_MILLION_CONTEXT_PATTERN.test(model)) return 1_000_000;
   return null;
 }
 
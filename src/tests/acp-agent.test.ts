@@ -1120,6 +1120,38 @@ describe("toolUpdateFromEditToolResponse", () => {
   });
 });
 
+describe("Pushable", () => {
+  it("yields a large backlog in push order", async () => {
+    const pushable = new Pushable<number>();
+    for (let i = 0; i < 5000; i++) {
+      pushable.push(i);
+    }
+    pushable.end();
+
+    const received: number[] = [];
+    for await (const item of pushable) {
+      received.push(item);
+    }
+    expect(received).toEqual(Array.from({ length: 5000 }, (_, i) => i));
+  });
+
+  it("interleaves pushes with consumption", async () => {
+    const pushable = new Pushable<string>();
+    const iterator = pushable[Symbol.asyncIterator]();
+
+    pushable.push("a");
+    pushable.push("b");
+    expect(await iterator.next()).toEqual({ value: "a", done: false });
+    pushable.push("c");
+    expect(await iterator.next()).toEqual({ value: "b", done: false });
+    expect(await iterator.next()).toEqual({ value: "c", done: false });
+
+    const pending = iterator.next();
+    pushable.push("d");
+    expect(await pending).toEqual({ value: "d", done: false });
+  });
+});
+
 describe("escape markdown", () => {
   it("should escape markdown characters", () => {
     let text = "Hello *world*!";
@@ -1129,6 +1161,10 @@ describe("escape markdown", () => {
     text = "for example:\n```markdown\nHello *world*!\n```\n";
     escaped = markdownEscape(text);
     expect(escaped).toEqual("````\nfor example:\n```markdown\nHello *world*!\n```\n````");
+
+    text = "`````\nnested\n```\ninline ``````\n";
+    escaped = markdownEscape(text);
+    expect(escaped).toEqual("``````\n" + text + "``````");
   });
 });
 
@@ -1347,7 +1383,6 @@ describe("stop reason propagation", () => {
       configOptions: [],
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       abortController: new AbortController(),
       emitRawSDKMessages: false,
       contextWindowSize: 200000,
@@ -1490,7 +1525,6 @@ describe("stop reason propagation", () => {
       configOptions: [],
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       emitRawSDKMessages: false,
       contextWindowSize: 200000,
     };
@@ -1565,7 +1599,6 @@ describe("session/close", () => {
       configOptions: [],
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       abortController: new AbortController(),
       emitRawSDKMessages: false,
       contextWindowSize: 200000,
@@ -1660,7 +1693,6 @@ describe("getOrCreateSession param change detection", () => {
       configOptions: [],
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       abortController: new AbortController(),
       emitRawSDKMessages: false,
       contextWindowSize: 200000,
@@ -1893,7 +1925,6 @@ describe("usage_update computation", () => {
       configOptions: [],
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       abortController: new AbortController(),
       emitRawSDKMessages: false,
       contextWindowSize: 200000,
@@ -2781,7 +2812,6 @@ describe("emitRawSDKMessages", () => {
       configOptions: [],
       promptRunning: false,
       pendingMessages: new Map(),
-      nextPendingOrder: 0,
       abortController: new AbortController(),
       emitRawSDKMessages,
       contextWindowSize: 200000,
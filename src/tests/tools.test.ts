@@ -1385,3 +1385,55 @@ describe("toAcpNotifications - TodoWrite with undefined input regression", () =>
     expect(planUpdates).toHaveLength(1);
   });
 });
+
+describe("toAcpNotifications - parentToolUseId", () => {
+  const mockClient = {} as AgentSideConnection;
+  const mockLogger: Logger = { log: () => {}, error: () => {} };
+
+  it("adds _meta.claudeCode.parentToolUseId to a string update without _meta", () => {
+    const notifications = toAcpNotifications(
+      "subagent says hi",
+      "assistant",
+      "test-session",
+      {},
+      mockClient,
+      mockLogger,
+      { parentToolUseId: "toolu_parent" },
+    );
+
+    expect(notifications).toHaveLength(1);
+    expect(notifications[0].update).toEqual({
+      sessionUpdate: "agent_message_chunk",
+      content: { type: "text", text: "subagent says hi" },
+      _meta: { claudeCode: { parentToolUseId: "toolu_parent" } },
+    });
+  });
+
+  it("keeps the existing _meta.claudeCode fields of a tool_call", () => {
+    const notifications = toAcpNotifications(
+      [
+        {
+          type: "tool_use" as const,
+          id: "toolu_child",
+          name: "Read",
+          input: { file_path: "/tmp/file.txt" },
+        },
+      ],
+      "assistant",
+      "test-session",
+      {},
+      mockClient,
+      mockLogger,
+      { registerHooks: false, parentToolUseId: "toolu_parent" },
+    );
+
+    expect(notifications).toHaveLength(1);
+    expect(notifications[0].update).toMatchObject({
+      sessionUpdate: "tool_call",
+      toolCallId: "toolu_child",
+    });
+    expect(notifications[0].update._meta).toEqual({
+      claudeCode: { toolName: "Read", parentToolUseId: "toolu_parent" },
+    });
+  });
+});
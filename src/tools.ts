@@ -670,12 +670,16 @@ export function planEntries(input: { todos: ClaudePlanEntry[] } | undefined): Pl
 }
 
 export function markdownEscape(text: string): string {
-  let escape = "```";
-  for (const [m] of text.matchAll(/^```+/gm)) {
-    while (m.length >= escape.length) {
-      escape += "`";
+  // The fence must be longer than any fence that starts a line in the text.
+  let fenceLength = 3;
+  // Most file contents have no code fences at all; skip the line-by-line
+  // regex scan unless one can be present.
+  if (text.includes("```")) {
+    for (const [m] of text.matchAll(/^```+/gm)) {
+      fenceLength = Math.max(fenceLength, m.length + 1);
     }
   }
+  const escape = "`".repeat(fenceLength);
   return escape + "\n" + text + (text.endsWith("\n") ? "" : "\n") + escape;
 }
 
@@ -8,7 +8,10 @@ import { ClaudeCodeSettings, getManagedSettingsPath } from "./settings.js";
 
 // Useful for bridging push-based and async-iterator-based code.
 export class Pushable<T> implements AsyncIterable<T> {
+  // Items are consumed from `head` rather than with shift(), which is O(n)
+  // per call once a backlog builds up.
   private queue: T[] = [];
+  private head = 0;
   private resolvers: ((value: IteratorResult<T>) => void)[] = [];
   private done = false;
 
@@ -32,8 +35,16 @@ export class Pushable<T> implements AsyncIterable<T> {
   [Symbol.asyncIterator](): AsyncIterator<T> {
     return {
       next: (): Promise<IteratorResult<T>> => {
-        if (this.queue.length > 0) {
-          const value = this.queue.shift()!;
+        if (this.head < this.queue.length) {
+          const value = this.queue[this.head];
+          this.queue[this.head++] = undefined as any;
+          if (this.head === this.queue.length) {
+            this.queue = [];
+            this.head = 0;
+          } else if (this.head >= 1024 && this.head * 2 >= this.queue.length) {
+            this.queue = this.queue.slice(this.head);
+            this.head = 0;
+          }
           return Promise.resolve({ value, done: false });
         }
         if (this.done) {
@@ -52,7 +63,8 @@ export function nodeToWebWritable(nodeStream: Writable): WritableStream<Uint8Arr
   return new WritableStream<Uint8Array>({
     write(chunk) {
       return new Promise<void>((resolve, reject) => {
-        nodeStream.write(Buffer.from(chunk), (err) => {
+        // Writable accepts a Uint8Array directly, so don't copy the frame.
+        nodeStream.write(chunk, (err) => {
           if (err) {
             reject(err);
           } else {
@@ -68,7 +80,8 @@ export function nodeToWebReadable(nodeStream: Readable): ReadableStream<Uint8Arr
   return new ReadableStream<Uint8Array>({
     start(controller) {
       nodeStream.on("data", (chunk: Buffer) => {
-        controller.enqueue(new Uint8Array(chunk));
+        // Buffer is already a Uint8Array, so enqueue it without copying.
+        controller.enqueue(chunk);
       });
       nodeStream.on("end", () => controller.close());
       nodeStream.on("error", (err) => controller.error(err));